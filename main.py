@@ -16,25 +16,55 @@ Run:
 
 from __future__ import annotations
 
+import asyncio
+import hashlib
 import json
+import logging
+import math
 import os
+import threading
+import time
 from dataclasses import dataclass
 from datetime import datetime, timezone
-from typing import Dict, List, Optional
+from functools import lru_cache
+from typing import Dict, List, Literal, Optional, Tuple
 
-from fastapi import FastAPI, HTTPException, Depends, Header, Query
+from cachetools import LRUCache
+from fastapi import BackgroundTasks, FastAPI, HTTPException, Depends, Header, Query, Request, Response
+from fastapi.routing import APIRoute
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.responses import JSONResponse
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, ValidationError
+
+try:
+    import orjson
+except ImportError:  # optional speedup; stdlib json is used otherwise
+    orjson = None
 
 DATA_FILE = "summaries.json"  # finished summaries persisted here (per user)
+LOG_FILE = "summaries.log"  # summaries finished since the last compaction, one JSON record per line
+ROTATED_LOG_FILE = LOG_FILE + ".1"  # LOG_FILE as of a compaction, kept until its snapshot is on disk
+COMPACT_INTERVAL = 30.0  # seconds between folding LOG_FILE into DATA_FILE
+COMPACT_MAX_BYTES = 1 << 20  # compact sooner once LOG_FILE grows past this
+
+logger = logging.getLogger(__name__)
 
 # ----------------------------
 # Helpers: time & summary math
 # ----------------------------
 
+# (whole second, formatted string) of the last now_iso() call
+_NOW_CACHE: Tuple[int, str] = (-1, "")
+
 def now_iso() -> str:
-    return datetime.now(timezone.utc).replace(microsecond=0).isoformat()
+    # Output has second precision, so rebuild the string at most once per second
+    global _NOW_CACHE
+    sec = int(time.time())
+    cached_sec, cached = _NOW_CACHE
+    if sec != cached_sec:
+        cached = datetime.fromtimestamp(sec, tz=timezone.utc).isoformat()
+        _NOW_CACHE = (sec, cached)
+    return cached
 
 def parse_iso(ts: str) -> datetime:
     # Accept trailing Z or timezone offset
@@ -42,6 +72,49 @@ def parse_iso(ts: str) -> datetime:
         return datetime.fromisoformat(ts.replace('Z', '+00:00'))
     return datetime.fromisoformat(ts)
 
+@lru_cache(maxsize=4096)
+def normalize_iso(ts: str) -> str:
+    # Canonical UTC form (same shape as now_iso()); these strings order
+    # lexicographically in time order. Naive timestamps are taken as UTC.
+    dt = parse_iso(ts)
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.astimezone(timezone.utc).replace(microsecond=0).isoformat()
+
+def _dumps(obj: object, indent: bool = False) -> bytes:
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        try:
+            return orjson.dumps(obj, option=option)
+        except TypeError:
+            # e.g. ints beyond 64 bits, which _int_if_whole can produce; stdlib json handles them
+            pass
+    # Write non-finite floats as null, like orjson, so the output stays standard JSON
+    obj = _finite(obj)
+    if indent:
+        return json.dumps(obj, indent=2, allow_nan=False).encode('utf-8')
+    return json.dumps(obj, separators=(',', ':'), ensure_ascii=False, allow_nan=False).encode('utf-8')
+
+def _finite(obj: object) -> object:
+    if isinstance(obj, float):
+        return obj if math.isfinite(obj) else None
+    if isinstance(obj, dict):
+        return {k: _finite(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_finite(v) for v in obj]
+    return obj
+
+def _loads(data: bytes) -> object:
+    if orjson is not None:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            # stdlib json also reads Infinity/NaN, which older snapshots may contain
+            pass
+    return json.loads(data)
+
 def _int_if_whole(x: float):
     try:
         return int(x) if float(x).is_integer() else float(x)
@@ -54,7 +127,7 @@ def _int_if_whole(x: float):
 
 class EventIn(BaseModel):
     session_id: str = Field(..., min_length=1, max_length=128)
-    event_type: str = Field(..., pattern=r"^(bet|win|loss)$")
+    event_type: Literal["bet", "win", "loss"]
     amount: float = Field(..., ge=0)
     timestamp: Optional[str] = Field(None, description="ISO-8601 timestamp; defaults to now if omitted")
 
@@ -90,48 +163,315 @@ class PingResponse(BaseModel):
 # In-memory stores
 # ----------------------------
 
-# TOKEN_USER maps bearer token -> user_id (first seen via X-User-Id on request)
-TOKEN_USER: Dict[str, str] = {}
-
-# ACTIVE[user_id][session_id] = { 'start_time': str|None, 'end_time': str|None, 'events': [ {event} ] }
-ACTIVE: Dict[str, Dict[str, Dict[str, object]]] = {}
+# TOKEN_USER maps a token fingerprint (16-byte blake2b digest of the bearer token,
+# so raw tokens are never kept) -> user_id (first seen via X-User-Id on request).
+# Split into TOKEN_SHARDS LRU caches by token hash, each with its own lock; once
+# full, the least recently used binding is dropped and that token must re-bind.
+TOKEN_USER_MAX = 100_000
+TOKEN_SHARDS = 16
+TOKEN_USER: List[LRUCache] = [LRUCache(maxsize=TOKEN_USER_MAX // TOKEN_SHARDS) for _ in range(TOKEN_SHARDS)]
+TOKEN_LOCKS: List[threading.Lock] = [threading.Lock() for _ in range(TOKEN_SHARDS)]
+
+@dataclass(slots=True)
+class ActiveSession:
+    # Running totals kept up to date by record_event; individual events are not stored.
+    # min_ts/max_ts are normalize_iso() strings, compared lexicographically.
+    min_ts: str
+    max_ts: str
+    end_time: Optional[str] = None
+    end_seq: int = 0  # bumped by each /session/end, so a slower, older end can't overwrite a newer one
+    rounds: int = 0
+    total_bets: float = 0.0
+    total_wins: float = 0.0
+
+# ACTIVE_SHARDS[_shard index][user_id][session_id] = ActiveSession. Users are spread
+# over USER_SHARDS dicts; each shard's lock guards its users' active sessions and is
+# never held across disk I/O, so requests for unrelated users only contend briefly.
+# FINISHED changes under _log_lock.
+USER_SHARDS = 16
+ACTIVE_SHARDS: List[Dict[str, Dict[str, ActiveSession]]] = [{} for _ in range(USER_SHARDS)]
+ACTIVE_LOCKS: List[threading.Lock] = [threading.Lock() for _ in range(USER_SHARDS)]
+
+def _shard(user_id: str) -> Tuple[Dict[str, Dict[str, ActiveSession]], threading.Lock]:
+    i = hash(user_id) % USER_SHARDS
+    return ACTIVE_SHARDS[i], ACTIVE_LOCKS[i]
 
 # FINISHED[user_id] = [Summary dicts]
 FINISHED: Dict[str, List[Dict[str, object]]] = {}
 
+# FINISHED_INDEX[user_id][session_id] = position of that summary in FINISHED[user_id]
+FINISHED_INDEX: Dict[str, Dict[str, int]] = {}
+
+# LATEST[user_id] = Summary dict with the greatest end_time for that user
+LATEST: Dict[str, Dict[str, object]] = {}
+
+# EXPORT_CACHE[(user_id, session_id)] = encoded /session/export body of a finished summary.
+# Written whenever a session ends, so a re-ended session replaces its entry.
+EXPORT_CACHE_MAX = 10_000
+EXPORT_CACHE: LRUCache = LRUCache(maxsize=EXPORT_CACHE_MAX)
+EXPORT_LOCK = threading.Lock()
+
+def cache_export(user_id: str, summary: Dict[str, object]) -> bytes:
+    # Only cache the summary FINISHED holds now, so a slow caller with an older
+    # summary can't replace a newer entry
+    body = _dumps(summary)
+    with EXPORT_LOCK:
+        if find_finished(user_id, summary["session_id"]) is summary:
+            EXPORT_CACHE[(user_id, summary["session_id"])] = body
+    return body
+
+def _is_newer(summary: Dict[str, object], latest: Optional[Dict[str, object]]) -> bool:
+    # Ties keep the earlier summary, matching max() over the list
+    if latest is None or latest.get("session_id") == summary.get("session_id"):
+        return True
+    return (summary.get("end_time") or "") > (latest.get("end_time") or "")
+
+def find_finished(user_id: str, session_id: str) -> Optional[Dict[str, object]]:
+    i = FINISHED_INDEX.get(user_id, {}).get(session_id)
+    if i is None:
+        return None
+    return FINISHED[user_id][i]
+
+def store_finished(user_id: str, summary: Dict[str, object]) -> None:
+    # Save into FINISHED (replace if exists) and keep the indexes in step
+    items = FINISHED.setdefault(user_id, [])
+    index = FINISHED_INDEX.setdefault(user_id, {})
+    session_id = summary["session_id"]
+    i = index.get(session_id)
+    if i is None:
+        index[session_id] = len(items)
+        items.append(summary)
+    else:
+        items[i] = summary
+    if _is_newer(summary, LATEST.get(user_id)):
+        LATEST[user_id] = summary
+
+def _rebuild_indexes() -> None:
+    FINISHED_INDEX.clear()
+    LATEST.clear()
+    for user_id, items in FINISHED.items():
+        index = FINISHED_INDEX[user_id] = {}
+        for i, s in enumerate(items):
+            index.setdefault(s.get("session_id"), i)
+            if _is_newer(s, LATEST.get(user_id)):
+                LATEST[user_id] = s
+
 # ----------------------------
 # Persistence for finished summaries (simple file)
 # ----------------------------
 
+# Every /session/end appends one line to LOG_FILE. Compaction renames the log
+# to ROTATED_LOG_FILE and copies FINISHED under _log_lock, then writes the
+# DATA_FILE snapshot and deletes the rotated log without holding it. It runs
+# every COMPACT_INTERVAL seconds, and as a response background task once the
+# log passes COMPACT_MAX_BYTES.
+
+_log_lock = threading.Lock()  # guards the log handle and changes to FINISHED
+_compact_lock = threading.Lock()  # one compaction at a time
+_log_file = None  # append-mode handle for LOG_FILE, opened on first use
+_log_bytes = 0  # bytes appended to LOG_FILE since the last compaction
+_logged_seq: Dict[Tuple[str, str], int] = {}  # last end_seq logged per (user_id, session_id)
+
 def load_finished() -> None:
-    global FINISHED
-    if not os.path.exists(DATA_FILE):
-        FINISHED = {}
-        return
-    try:
-        with open(DATA_FILE, 'r', encoding='utf-8') as f:
-            data = json.load(f)
+    global FINISHED, _log_file, _log_bytes
+    with _log_lock:
+        if _log_file is not None:
+            _log_file.close()
+            _log_file = None
+        _logged_seq.clear()  # end_seq restarts with the active sessions
+    FINISHED = {}
+    if os.path.exists(DATA_FILE):
+        with open(DATA_FILE, 'rb') as f:
+            raw = f.read()
+        try:
+            data = _loads(raw) if raw.strip() else {}
+        except Exception:
+            data = None
         # validate minimal structure
-        FINISHED = data if isinstance(data, dict) else {}
+        if isinstance(data, dict):
+            FINISHED = data
+        else:
+            # Keep the unreadable snapshot for recovery rather than letting the
+            # log replay below overwrite it
+            aside = f"{DATA_FILE}.unreadable-{int(time.time())}"
+            os.replace(DATA_FILE, aside)
+            logger.error("Could not read %s; moved it to %s and starting without it", DATA_FILE, aside)
+    _rebuild_indexes()
+
+    # Replay summaries appended after the last snapshot, oldest log first
+    _log_bytes = 0
+    logs = [path for path in (ROTATED_LOG_FILE, LOG_FILE) if os.path.exists(path)]
+    for path in logs:
+        with open(path, 'rb') as f:
+            for line in f:
+                try:
+                    record = _loads(line)
+                    store_finished(record["u"], record["s"])
+                except Exception:
+                    # a torn final line from a crash mid-append
+                    continue
+    if logs:
+        # Fold the replayed logs in now so new appends never follow a torn line
+        save_finished(snapshot_finished())
+        for path in logs:
+            os.remove(path)
+
+def snapshot_finished() -> Dict[str, List[Dict[str, object]]]:
+    # Shallow copy for serializing; call with _log_lock held. Stored summary
+    # dicts are replaced, never mutated, so copying the lists is enough.
+    return {user_id: list(items) for user_id, items in FINISHED.items()}
+
+def save_finished(snapshot: Dict[str, List[Dict[str, object]]]) -> None:
+    tmp = DATA_FILE + '.tmp'
+    try:
+        with open(tmp, 'wb') as f:
+            f.write(_dumps(snapshot, indent=True))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, DATA_FILE)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    # Make the renames durable before the caller deletes the rotated log
+    if hasattr(os, 'O_DIRECTORY'):  # not available (or needed) on Windows
+        dir_fd = os.open(os.path.dirname(os.path.abspath(DATA_FILE)), os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+def append_finished(user_id: str, summary: Dict[str, object], seq: int = 0) -> bool:
+    # Log the summary, then store it. Encoding first means a summary that can't
+    # be logged never reaches FINISHED, and storing under the log lock keeps
+    # FINISHED in the same order as the log. A non-zero seq (ActiveSession.end_seq)
+    # that is not newer than the last one logged for the session is dropped.
+    global _log_file, _log_bytes
+    key = (user_id, summary["session_id"])
+    line = _dumps({"u": user_id, "s": summary}) + b"\n"
+    with _log_lock:
+        if seq and seq <= _logged_seq.get(key, 0):
+            return False
+        if _log_file is None:
+            _log_file = open(LOG_FILE, 'ab')
+        _log_file.write(line)
+        _log_file.flush()
+        os.fsync(_log_file.fileno())
+        _log_bytes += len(line)
+        store_finished(user_id, summary)
+        if seq:
+            _logged_seq[key] = seq
+    return True
+
+def compact_finished(min_bytes: int = 0) -> None:
+    # Skips the snapshot if fewer than min_bytes were logged since the last one,
+    # unless a failed compaction left a rotated log waiting to be folded in
+    global _log_file, _log_bytes
+    with _compact_lock:
+        with _log_lock:
+            if _log_bytes < min_bytes and not os.path.exists(ROTATED_LOG_FILE):
+                return
+            # A failed compaction leaves ROTATED_LOG_FILE behind; keep it, and keep
+            # appending to LOG_FILE, until a snapshot covering both is written
+            if not os.path.exists(ROTATED_LOG_FILE):
+                if _log_file is not None:
+                    _log_file.close()
+                    _log_file = None
+                if os.path.exists(LOG_FILE):
+                    os.replace(LOG_FILE, ROTATED_LOG_FILE)
+                _log_bytes = 0
+            snapshot = snapshot_finished()
+        save_finished(snapshot)
+        if os.path.exists(ROTATED_LOG_FILE):
+            os.remove(ROTATED_LOG_FILE)
+
+def _compact_or_log(min_bytes: int = 0) -> None:
+    # For background callers: a failed compaction leaves the log in place, so
+    # nothing is lost and the next attempt retries it
+    try:
+        compact_finished(min_bytes)
     except Exception:
-        FINISHED = {}
+        logger.exception("Compacting %s into %s failed", LOG_FILE, DATA_FILE)
 
-def save_finished() -> None:
-    tmp = DATA_FILE + '.tmp'
-    with open(tmp, 'w', encoding='utf-8') as f:
-        json.dump(FINISHED, f, indent=2)
-    os.replace(tmp, DATA_FILE)
+async def _compact_periodically() -> None:
+    while True:
+        await asyncio.sleep(COMPACT_INTERVAL)
+        await asyncio.to_thread(_compact_or_log, 1)
 
 # ----------------------------
 # FastAPI app + security
 # ----------------------------
 
-app = FastAPI(title="Session Summary Microservice", version="1.0.0")
+class _ParsedBodyRequest(Request):
+    # Request whose JSON body was already validated into a model instance
+    parsed_body: Optional[BaseModel] = None
+
+    async def json(self):
+        if self.parsed_body is not None:
+            return self.parsed_body
+        return await super().json()
+
+class FastValidateRoute(APIRoute):
+    """Validate a single JSON body model straight from the raw request bytes.
+
+    FastAPI normally decodes the body with stdlib json and then validates the
+    resulting dict. model_validate_json does both in one pass; the instance is
+    handed back to FastAPI through Request.json(), and pydantic accepts an
+    existing model instance without validating it again. Bodies that fail
+    validation take FastAPI's usual path, so only the error case parses twice.
+    """
+
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+        params = self.dependant.body_params
+        if len(params) != 1 or getattr(params[0].field_info, 'embed', False):
+            return handler
+        model = params[0].field_info.annotation
+        if not (isinstance(model, type) and issubclass(model, BaseModel)):
+            return handler
+
+        async def validate_then_handle(request: Request) -> Response:
+            request = _ParsedBodyRequest(request.scope, request.receive)
+            body = await request.body()
+            if body:
+                try:
+                    request.parsed_body = model.model_validate_json(body)
+                except ValidationError:
+                    # Leave invalid bodies to FastAPI so its errors are reported as
+                    # before, after dependencies such as authentication have run
+                    pass
+            return await handler(request)
+
+        return validate_then_handle
+
+class ORJSONResponse(JSONResponse):
+    # Same compact, standard JSON as JSONResponse (no NaN/Infinity), encoded by
+    # orjson when it is installed and the value allows it
+    def render(self, content) -> bytes:
+        return _dumps(content)
+
+app = FastAPI(title="Session Summary Microservice", version="1.0.0", default_response_class=ORJSONResponse)
+app.router.route_class = FastValidateRoute
 security = HTTPBearer(auto_error=True)
 
+_compactor: Optional[asyncio.Task] = None
+
 @app.on_event("startup")
-def _startup() -> None:
+async def _startup() -> None:
+    global _compactor
     load_finished()
+    _compactor = asyncio.create_task(_compact_periodically())
+
+@app.on_event("shutdown")
+async def _shutdown() -> None:
+    global _log_file
+    if _compactor is not None:
+        _compactor.cancel()
+    _compact_or_log()
+    with _log_lock:
+        if _log_file is not None:
+            _log_file.close()
+            _log_file = None
 
 # Dependency: get user_id from bearer token, binding on first use via X-User-Id
 def current_user_id(
@@ -139,60 +479,52 @@ def current_user_id(
     x_user_id: Optional[str] = Header(None, alias="X-User-Id"),
 ) -> str:
     token = credentials.credentials  # raw token value (no "Bearer ")
-    user_id = TOKEN_USER.get(token)
-    if user_id:
-        # If client also sent X-User-Id, enforce consistency
-        if x_user_id and x_user_id != user_id:
-            raise HTTPException(status_code=403, detail="Token already bound to a different user")
-        return user_id
-    # First time seeing this token; require X-User-Id to bind
-    if not x_user_id:
-        raise HTTPException(status_code=401, detail="Unknown token. Include X-User-Id to bind.")
-    TOKEN_USER[token] = x_user_id
-    return x_user_id
+    key = hashlib.blake2b(token.encode('utf-8'), digest_size=16).digest()
+    shard = key[0] % TOKEN_SHARDS
+    with TOKEN_LOCKS[shard]:
+        bindings = TOKEN_USER[shard]
+        user_id = bindings.get(key)
+        if user_id:
+            # If client also sent X-User-Id, enforce consistency
+            if x_user_id and x_user_id != user_id:
+                raise HTTPException(status_code=403, detail="Token already bound to a different user")
+            return user_id
+        # First time seeing this token; require X-User-Id to bind
+        if not x_user_id:
+            raise HTTPException(status_code=401, detail="Unknown token. Include X-User-Id to bind.")
+        bindings[key] = x_user_id
+        return x_user_id
 
 # ----------------------------
 # Core logic
 # ----------------------------
 
 def compute_summary(user_id: str, session_id: str) -> Summary:
-    session = ACTIVE.get(user_id, {}).get(session_id)
-    if not session:
+    # Callers hold the user's shard lock
+    active, _ = _shard(user_id)
+    session = active.get(user_id, {}).get(session_id)
+    if session is None:
         # Try finished summaries
-        for s in FINISHED.get(user_id, []):
-            if s.get('session_id') == session_id:
-                return Summary(**s)  # type: ignore[arg-type]
+        s = find_finished(user_id, session_id)
+        if s is not None:
+            return Summary.model_construct(**s)
         raise HTTPException(status_code=404, detail="Session not found")
 
-    events = session.get('events', [])
-    # Count one round per bet
-    rounds = sum(1 for e in events if e.get('event_type') == 'bet')
-    total_bets = sum(float(e.get('amount', 0)) for e in events if e.get('event_type') == 'bet')
-    total_wins = sum(float(e.get('amount', 0)) for e in events if e.get('event_type') == 'win')
+    rounds = session.rounds
+    total_bets = session.total_bets
+    total_wins = session.total_wins
     net_change = total_wins - total_bets
 
-    # Timestamps
-    ts_list: List[datetime] = []
-    for e in events:
-        ts = e.get('timestamp')
-        if isinstance(ts, str):
-            try:
-                ts_list.append(parse_iso(ts))
-            except Exception:
-                pass
-    start_time = session.get('start_time')
-    end_time = session.get('end_time')
-    if ts_list:
-        ts_list.sort()
-        start_time = ts_list[0].replace(microsecond=0, tzinfo=timezone.utc).isoformat()
-        if end_time is None:
-            end_time = ts_list[-1].replace(microsecond=0, tzinfo=timezone.utc).isoformat()
-
-    result = Summary(
+    start_time = session.min_ts
+    end_time = session.end_time
+    if end_time is None:
+        end_time = session.max_ts
+
+    result = Summary.model_construct(
         session_id=session_id,
         user_id=user_id,
-        start_time=start_time or now_iso(),
-        end_time=end_time or now_iso(),
+        start_time=start_time,
+        end_time=end_time,
         rounds=int(rounds),
         total_bets=_int_if_whole(total_bets),
         total_wins=_int_if_whole(total_wins),
@@ -210,60 +542,73 @@ def root():
 
 @app.post("/session/event")
 def record_event(req: EventIn, user_id: str = Depends(current_user_id)):
-    # Validate event_type via regex already, validate timestamp format if provided
-    ts = req.timestamp
-    if ts is None:
-        ts = now_iso()
+    # event_type is checked by EventIn; validate timestamp format if provided
+    if req.timestamp is None:
+        ts = now_iso()  # already canonical
     else:
         try:
-            _ = parse_iso(ts)
+            ts = normalize_iso(req.timestamp)
         except Exception:
             raise HTTPException(status_code=400, detail="timestamp must be ISO-8601 (e.g., 2026-02-12T14:05:00Z)")
 
-    user_sessions = ACTIVE.setdefault(user_id, {})
-    sess = user_sessions.get(req.session_id)
-    if sess is None:
-        sess = {"start_time": ts, "end_time": None, "events": []}
-        user_sessions[req.session_id] = sess
-
-    sess["events"].append({
-        "event_type": req.event_type,
-        "amount": float(req.amount),
-        "timestamp": ts,
-    })
+    active, lock = _shard(user_id)
+    with lock:
+        user_sessions = active.setdefault(user_id, {})
+        sess = user_sessions.get(req.session_id)
+        if sess is None:
+            sess = ActiveSession(min_ts=ts, max_ts=ts)
+            user_sessions[req.session_id] = sess
+
+        # Count one round per bet
+        if req.event_type == "bet":
+            sess.rounds += 1
+            sess.total_bets += float(req.amount)
+        elif req.event_type == "win":
+            sess.total_wins += float(req.amount)
+        if ts < sess.min_ts:
+            sess.min_ts = ts
+        if ts > sess.max_ts:
+            sess.max_ts = ts
 
     return {"ok": True, "message": "Event recorded"}
 
-@app.post("/session/end", response_model=WrappedSummary)
-def end_session(req: EndSessionIn, user_id: str = Depends(current_user_id)) -> WrappedSummary:
-    # Mark end time
-    sess = ACTIVE.get(user_id, {}).get(req.session_id)
-    if not sess:
-        raise HTTPException(status_code=404, detail="Session not found")
-    if sess.get("end_time") is None:
-        sess["end_time"] = now_iso()
-
-    summary = compute_summary(user_id, req.session_id).model_dump()
-
-    # Save into FINISHED (replace if exists)
-    items = FINISHED.setdefault(user_id, [])
-    for i, s in enumerate(items):
-        if s.get("session_id") == req.session_id:
-            items[i] = summary
-            break
-    else:
-        items.append(summary)
-    save_finished()
-
-    return WrappedSummary(ok=True, summary=Summary(**summary))
-
-@app.get("/session/latest", response_model=LatestResponse)
-def get_latest(user_id: str = Depends(current_user_id)) -> LatestResponse:
-    items = FINISHED.get(user_id, [])
-    if not items:
-        return LatestResponse(ok=False, message="No session summary found for this user.")
-    latest = max(items, key=lambda s: s.get("end_time") or "")
-    return LatestResponse(ok=True, summary=Summary(**latest))
+# /session/end and /session/latest return trusted, already-built dicts, so they skip
+# response_model validation; the models are only used to document the responses.
+@app.post("/session/end", responses={200: {"model": WrappedSummary}})
+def end_session(
+    req: EndSessionIn,
+    background_tasks: BackgroundTasks,
+    user_id: str = Depends(current_user_id),
+) -> ORJSONResponse:
+    active, lock = _shard(user_id)
+    with lock:
+        # Mark end time
+        sess = active.get(user_id, {}).get(req.session_id)
+        if sess is None:
+            raise HTTPException(status_code=404, detail="Session not found")
+        if sess.end_time is None:
+            sess.end_time = now_iso()
+        sess.end_seq += 1
+        seq = sess.end_seq
+
+        summary = compute_summary(user_id, req.session_id).model_dump()
+
+    # The fsync'd append runs outside the shard lock; seq keeps concurrent ends
+    # of the same session from storing an older summary over a newer one
+    if append_finished(user_id, summary, seq):
+        cache_export(user_id, summary)
+    if _log_bytes >= COMPACT_MAX_BYTES:
+        # The append above is already durable; fold the log in after responding
+        background_tasks.add_task(_compact_or_log, COMPACT_MAX_BYTES)
+
+    return ORJSONResponse({"ok": True, "summary": summary})
+
+@app.get("/session/latest", responses={200: {"model": LatestResponse}})
+def get_latest(user_id: str = Depends(current_user_id)) -> ORJSONResponse:
+    latest = LATEST.get(user_id)
+    if latest is None:
+        return ORJSONResponse({"ok": False, "summary": None, "message": "No session summary found for this user."})
+    return ORJSONResponse({"ok": True, "summary": latest, "message": None})
 
 @app.get("/session/export")
 def export_session(
@@ -276,17 +621,18 @@ def export_session(
         raise HTTPException(status_code=400, detail="session_id query param is required")
 
     # Prefer finished summary, else compute from active
-    for s in FINISHED.get(user_id, []):
-        if s.get("session_id") == sid:
-            return JSONResponse(content=s)
-    # Try active
-    try:
+    with EXPORT_LOCK:
+        body = EXPORT_CACHE.get((user_id, sid))
+    if body is not None:
+        return Response(content=body, media_type="application/json")
+    s = find_finished(user_id, sid)
+    if s is not None:
+        return Response(content=cache_export(user_id, s), media_type="application/json")
+    # Try active (404 if unknown)
+    _, lock = _shard(user_id)
+    with lock:
         summary = compute_summary(user_id, sid).model_dump()
-    except HTTPException as e:
-        if e.status_code == 404:
-            raise
-        raise
-    return JSONResponse(content=summary)
+    return ORJSONResponse(content=summary)
 
 @app.post("/ping", response_model=PingResponse)
 def ping(req: PingRequest) -> PingResponse:
@@ -0,0 +1,204 @@
+"""
+Tests for finished summaries: append log, replay, compaction and JSON encoding.
+
+Run:
+  pip install -r requirements.txt pytest httpx
+  pytest -q
+"""
+
+import json
+import os
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+
+AUTH = {"Authorization": "Bearer test-token", "X-User-Id": "alice"}
+
+
+@pytest.fixture(autouse=True)
+def fresh_state(tmp_path, monkeypatch):
+    # DATA_FILE and the logs are relative paths, so each test gets its own directory
+    monkeypatch.chdir(tmp_path)
+    for shard in main.ACTIVE_SHARDS:
+        shard.clear()
+    for bindings in main.TOKEN_USER:
+        bindings.clear()
+    main.EXPORT_CACHE.clear()
+    main.load_finished()
+    yield
+    main.load_finished()  # closes the log handle
+
+
+def play_session(client, session_id, events):
+    for event_type, amount, ts in events:
+        r = client.post(
+            "/session/event",
+            json={"session_id": session_id, "event_type": event_type, "amount": amount, "timestamp": ts},
+            headers=AUTH,
+        )
+        assert r.status_code == 200
+    r = client.post("/session/end", json={"session_id": session_id}, headers=AUTH)
+    assert r.status_code == 200
+    return r.json()["summary"]
+
+
+def test_end_session_appends_to_log_and_restart_replays_it():
+    client = TestClient(main.app)  # no startup/shutdown, so nothing compacts
+    summary = play_session(client, "s1", [("bet", 5, "2026-02-12T14:05:00Z"), ("win", 8, "2026-02-12T14:06:00Z")])
+    assert summary["net_change"] == 3
+
+    with open(main.LOG_FILE, "rb") as f:
+        records = [json.loads(line) for line in f]
+    assert records == [{"u": "alice", "s": summary}]
+
+    main.FINISHED.clear()
+    main.load_finished()
+    assert main.LATEST["alice"] == summary
+    assert main.FINISHED_INDEX == {"alice": {"s1": 0}}
+    # Replayed logs are folded into a snapshot at startup
+    assert not os.path.exists(main.LOG_FILE)
+    with open(main.DATA_FILE) as f:
+        assert json.load(f) == {"alice": [summary]}
+
+
+def test_replay_skips_torn_final_line():
+    first = {"session_id": "a", "user_id": "alice", "end_time": "2026-02-12T14:00:00+00:00"}
+    second = {"session_id": "b", "user_id": "alice", "end_time": "2026-02-12T15:00:00+00:00"}
+    with open(main.LOG_FILE, "wb") as f:
+        f.write(json.dumps({"u": "alice", "s": first}).encode() + b"\n")
+        f.write(json.dumps({"u": "alice", "s": second}).encode() + b"\n")
+        f.write(b'{"u": "alice", "s": {"sess')
+
+    main.load_finished()
+    assert main.FINISHED == {"alice": [first, second]}
+    assert main.LATEST["alice"] == second
+
+
+def test_rebuilt_latest_keeps_earlier_summary_on_end_time_tie():
+    same_end = "2026-02-12T15:00:00+00:00"
+    items = [
+        {"session_id": "a", "end_time": same_end},
+        {"session_id": "b", "end_time": "2026-02-12T14:00:00+00:00"},
+        {"session_id": "c", "end_time": same_end},
+    ]
+    with open(main.DATA_FILE, "w") as f:
+        json.dump({"alice": items}, f)
+
+    main.load_finished()
+    assert main.LATEST["alice"]["session_id"] == "a"
+    assert main.FINISHED_INDEX["alice"] == {"a": 0, "b": 1, "c": 2}
+
+
+def test_compaction_writes_snapshot_then_drops_log():
+    client = TestClient(main.app)
+    summary = play_session(client, "s1", [("bet", 2, None)])
+    main.compact_finished()
+
+    assert not os.path.exists(main.LOG_FILE)
+    assert not os.path.exists(main.ROTATED_LOG_FILE)
+    with open(main.DATA_FILE) as f:
+        assert json.load(f) == {"alice": [summary]}
+
+    # Appends after a compaction start a new log
+    later = play_session(client, "s2", [("bet", 1, None)])
+    main.load_finished()
+    assert main.FINISHED["alice"] == [summary, later]
+
+
+def test_failed_compaction_keeps_rotated_log(monkeypatch):
+    client = TestClient(main.app)
+    summary = play_session(client, "s1", [("bet", 2, None)])
+
+    def fail(snapshot):
+        raise OSError("disk full")
+
+    with monkeypatch.context() as m:
+        m.setattr(main, "save_finished", fail)
+        main._compact_or_log()  # logged, not raised
+    assert os.path.exists(main.ROTATED_LOG_FILE)
+
+    # The periodic compaction retries it even though nothing new was logged
+    main._compact_or_log(1)
+    assert not os.path.exists(main.ROTATED_LOG_FILE)
+    with open(main.DATA_FILE) as f:
+        assert json.load(f) == {"alice": [summary]}
+
+    later = play_session(client, "s2", [("bet", 1, None)])
+    main.load_finished()
+    assert main.FINISHED["alice"] == [summary, later]
+    assert not os.path.exists(main.ROTATED_LOG_FILE)
+
+
+def test_shutdown_compacts_amounts_beyond_64_bits():
+    with TestClient(main.app) as client:
+        summary = play_session(client, "s1", [("bet", 1e20, None)])
+        assert summary["total_bets"] == 10**20
+        r = client.get("/session/export", params={"session_id": "s1"}, headers=AUTH)
+        assert r.json() == summary
+
+    assert not os.path.exists(main.LOG_FILE)
+    assert not os.path.exists(main.DATA_FILE + ".tmp")
+    with open(main.DATA_FILE) as f:
+        assert json.load(f) == {"alice": [summary]}
+
+
+def test_non_finite_totals_round_trip_through_restart():
+    client = TestClient(main.app)
+    summary = play_session(client, "s1", [("bet", 1e308, None), ("bet", 1e308, None), ("win", 1e20, None)])
+    # total_wins is an int orjson can't encode, so this goes through the stdlib
+    # fallback, which must still write standard JSON (null for infinities)
+    assert summary["total_bets"] is None
+    assert summary["total_wins"] == 10**20
+
+    main.compact_finished()
+    main.load_finished()
+    assert main.FINISHED == {"alice": [summary]}
+
+
+def test_unreadable_snapshot_is_moved_aside_not_overwritten():
+    with open(main.DATA_FILE, "wb") as f:
+        f.write(b'{"alice": [{"session_id": "a"')
+    summary = {"session_id": "b", "user_id": "alice", "end_time": "2026-02-12T15:00:00+00:00"}
+    with open(main.LOG_FILE, "wb") as f:
+        f.write(json.dumps({"u": "alice", "s": summary}).encode() + b"\n")
+
+    main.load_finished()
+    assert main.FINISHED == {"alice": [summary]}
+    [aside] = [name for name in os.listdir() if name.startswith(main.DATA_FILE + ".unreadable-")]
+    with open(aside, "rb") as f:
+        assert f.read() == b'{"alice": [{"session_id": "a"'
+
+
+def test_empty_snapshot_file_loads_as_no_summaries():
+    open(main.DATA_FILE, "wb").close()
+    main.load_finished()
+    assert main.FINISHED == {}
+    assert os.listdir() == [main.DATA_FILE]
+
+
+def test_responses_are_standard_json_on_the_stdlib_fallback():
+    def reject(constant):
+        raise AssertionError(f"non-standard JSON constant {constant}")
+
+    client = TestClient(main.app)
+    for event_type, amount in [("bet", 1e308), ("bet", 1e308), ("win", 1e20)]:
+        client.post("/session/event", json={"session_id": "s1", "event_type": event_type, "amount": amount}, headers=AUTH)
+    r = client.post("/session/end", json={"session_id": "s1"}, headers=AUTH)
+    assert json.loads(r.content, parse_constant=reject)["summary"]["net_change"] is None
+    r = client.get("/session/latest", headers=AUTH)
+    assert json.loads(r.content, parse_constant=reject)["summary"]["total_bets"] is None
+
+
+def test_older_end_of_a_session_is_not_stored_over_a_newer_one():
+    newer = {"session_id": "s1", "user_id": "alice", "rounds": 2}
+    older = {"session_id": "s1", "user_id": "alice", "rounds": 1}
+    assert main.append_finished("alice", newer, seq=2)
+    assert not main.append_finished("alice", older, seq=1)
+    main.cache_export("alice", older)  # not what FINISHED holds, so not cached
+    assert main.find_finished("alice", "s1") is newer
+    assert ("alice", "s1") not in main.EXPORT_CACHE
+
+    main.load_finished()
+    assert main.FINISHED == {"alice": [newer]}